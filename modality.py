@@ -15,6 +15,8 @@
 #----------------------------------------------------------------------------
 
 import argparse
+import errno
+import hashlib
 import os
 from pprint import pprint
 from sets import Set
@@ -45,6 +47,13 @@ insert_mode_colors = {
     "status-fg": "colour230",
 }
 
+# Modes whose non-prefixed bindings get a key table of their own, so that
+# switching to them costs the same however many bindings they have.  The
+# root table, and with it the default mouse bindings and any "bind-key -n"
+# in .tmux.conf, is inactive in these modes.  Other modes bind their keys
+# in the root table.
+key_table_modes = Set( [ "command" ] )
+
 
 #----------------------------------------------------------------------------
 
@@ -76,64 +85,180 @@ parser.add_argument(
     action = 'store_const', const = True, required = False,
     help = 'disable use of a temp file (may be slower)'
 )
+parser.add_argument(
+    '-C', '--cache', dest = 'cache_dir', default = None,
+    action = 'store', required = False,
+    help = 'reuse generated scripts cached in the given directory'
+)
 parser.add_argument(
     'mode', metavar = 'mode', nargs = 1,
     help = 'mode to set'
 )
 
-args = parser.parse_args()
-#print(args.accumulate(args.arguments))
-
 
 #----------------------------------------------------------------------------
 
 batch_mode = None
+cache_dir = None
 use_mode_colors = None
 pass_through = None
 modality = os.path.abspath( __file__ )
+stamp = None
 
 
 #----------------------------------------------------------------------------
 
 def main( args ):
 
-    global batch_mode, pass_through, use_mode_colors
+    global batch_mode, cache_dir, pass_through, stamp, use_mode_colors
 
     batch_mode = not args.no_temp_file
     pass_through = args.pass_through
     use_mode_colors = args.use_mode_colors
-
+    if args.cache_dir is not None:
+        cache_dir = os.path.abspath( os.path.expanduser( args.cache_dir ) )
+    stamp = settings_stamp()
+
+    name = args.mode[ 0 ]
+
+    # A cached script depends only on the arguments and this file, so a
+    # hit skips building the modes altogether:
+    table_file = switch_file = None
+    if cache_dir is not None and batch_mode and args.filename is None:
+        make_cache_dir()
+        table_file = cache_path( name )
+        switch_file = cache_path( name + "-from-" + str( args.prior_mode ) )
+        if os.path.exists( table_file ) and os.path.exists( switch_file ):
+            execute_cached( name, table_file, switch_file )
+            return
+
+    # Only build the modes that are needed:
     modes = {
-        "command": mode_command(),
-        "default": mode_default(),
-        "empty": mode_empty(),
-        "insert": mode_insert(),
+        "command": mode_command,
+        "default": mode_default,
+        "empty": mode_empty,
+        "insert": mode_insert,
     }
 
-    Binding.default_bindings = modes[ "default" ].bound
+    if pass_through:
+        Binding.default_bindings = mode_default().table( use_prefix = True )
 
-    binder = modes[ args.mode[ 0 ] ]
+    binder = modes[ name ]()
 
     if args.prior_mode is not None:
-        binder.set_prior_mode( modes[ args.prior_mode ] )
+        binder.set_prior_mode( modes[ args.prior_mode ]() )
 
     if args.filename is not None:
         binder.write( args.filename )
+    elif switch_file is not None:
+        binder.cache( table_file, switch_file )
+        execute_cached( name, table_file, switch_file )
     else:
         binder.execute()
 
 
+#----------------------------------------------------------------------------
+
+# Get the cache file with the given name.
+def cache_path( name ):
+
+    return os.path.join( cache_dir, "modality-" + stamp + "-" + name + ".conf" )
+
+
+#----------------------------------------------------------------------------
+
+# Execute cached scripts for switching to the named mode.
+def execute_cached( name, table_file, switch_file ):
+
+    global tmux
+
+    table = table_name( name )
+    if table != "root":
+        installed = installed_table( name )
+        if installed != table:
+            if installed:
+                subprocess.call( [ tmux, "unbind-key", "-a", "-T", installed ] )
+            subprocess.call( [ tmux, "source-file", table_file ] )
+
+    subprocess.call( [ tmux, "source-file", switch_file ] )
+
+
+#----------------------------------------------------------------------------
+
+# Get the key table currently installed for the named mode, if any.
+def installed_table( name ):
+
+    global tmux
+
+    try:
+        output = subprocess.check_output(
+            [ tmux, "show-options", "-g", "-q", "-v", "@modality-" + name ]
+        )
+    except ( OSError, subprocess.CalledProcessError ):
+        return ""
+
+    return output.strip()
+
+
+#----------------------------------------------------------------------------
+
+# Create the cache directory if it does not exist yet.
+def make_cache_dir():
+
+    # Another mode switch may create it at the same time:
+    try:
+        os.makedirs( cache_dir )
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+#----------------------------------------------------------------------------
+
+# Get a stamp identifying the settings that generated bindings depend on.
+def settings_stamp():
+
+    # Include this file's modification time so that editing the bindings
+    # yields new key tables and cache files:
+    key = repr( (
+        pass_through,
+        use_mode_colors,
+        cache_dir,
+        python,
+        tmux,
+        modality,
+        os.path.getmtime( modality ),
+    ) )
+
+    return hashlib.md5( key ).hexdigest()[ :8 ]
+
+
+#----------------------------------------------------------------------------
+
+# Get the name of the key table for the named mode.
+def table_name( name ):
+
+    if name not in key_table_modes:
+        return "root"
+
+    return "modality-" + name + "-" + stamp
+
+
 #----------------------------------------------------------------------------
 
 def mode_command():
 
-    binder = Binder( batch_mode )
+    binder = Binder( "command", batch_mode )
 
     mc = " -c"
     if not use_mode_colors:
         mc = ""
 
-    insert_mode = [ "run-shell", python + ' ' + modality + mc + ' insert -p command' ]
+    cc = ""
+    if cache_dir is not None:
+        cc = " -C " + cache_dir
+
+    insert_mode = [ "run-shell", python + ' ' + modality + mc + cc + ' insert -p command' ]
 
     binder.disable_all_keys()
 
@@ -155,30 +280,15 @@ def mode_command():
     binder.bind( "|", [ "split-window", "-h" ] )
     binder.bind( "-", [ "split-window", "-v" ] )
     #binder.bind( "<", [ "rename-session" ] )
-    binder.bind( "1", [ "select-pane", "-t", "1" ] )
-    binder.bind( "2", [ "select-pane", "-t", "2" ] )
-    binder.bind( "3", [ "select-pane", "-t", "3" ] )
-    binder.bind( "4", [ "select-pane", "-t", "4" ] )
-    binder.bind( "5", [ "select-pane", "-t", "5" ] )
-    binder.bind( "6", [ "select-pane", "-t", "6" ] )
-    binder.bind( "7", [ "select-pane", "-t", "7" ] )
-    binder.bind( "8", [ "select-pane", "-t", "8" ] )
-    binder.bind( "9", [ "select-pane", "-t", "9" ] )
-    binder.bind( "0", [ "select-pane", "-t", "10" ] )
+    binder.bind_range( "1234567890", [ "select-pane", "-t", "{index}" ] )
     binder.bind( "H", [ "select-window", "-p" ] )
     binder.bind( "L", [ "select-window", "-n" ] )
     binder.bind( "n", [ "new-window" ] )
     binder.bind( "t", [ "clock-mode" ] )
-    binder.bind( "M-1", [ "select-window", "-t", ":1" ] )
-    binder.bind( "M-2", [ "select-window", "-t", ":2" ] )
-    binder.bind( "M-3", [ "select-window", "-t", ":3" ] )
-    binder.bind( "M-4", [ "select-window", "-t", ":4" ] )
-    binder.bind( "M-5", [ "select-window", "-t", ":5" ] )
-    binder.bind( "M-6", [ "select-window", "-t", ":6" ] )
-    binder.bind( "M-7", [ "select-window", "-t", ":7" ] )
-    binder.bind( "M-8", [ "select-window", "-t", ":8" ] )
-    binder.bind( "M-9", [ "select-window", "-t", ":9" ] )
-    binder.bind( "M-0", [ "select-window", "-t", ":10" ] )
+    binder.bind_range(
+        "1234567890", [ "select-window", "-t", ":{index}" ],
+        key_format = "M-{key}"
+    )
     binder.bind( "PageUp", [ "select-window", "-p" ] )
     binder.bind( "PageDown", [ "select-window", "-n" ] )
     binder.bind( "Enter", insert_mode )
@@ -216,7 +326,7 @@ def mode_command():
 
 def mode_default():
 
-    binder = Binder( batch_mode )
+    binder = Binder( "default", batch_mode )
 
     binder.bind( "C-b", [ "send-prefix" ], use_prefix = True )
     binder.bind( "C-o", [ "rotate-window" ], use_prefix = True )
@@ -234,16 +344,9 @@ def mode_default():
     binder.bind( ",", [ "command-prompt", "-I", "'#W'", "rename-window '%%'" ], use_prefix = True )
     binder.bind( "-", [ "delete-buffer" ], use_prefix = True )
     binder.bind( ".", [ "command-prompt", "move-window -t '%%'" ], use_prefix = True )
-    binder.bind( "0", [ "select-window", "-t :0" ], use_prefix = True )
-    binder.bind( "1", [ "select-window", "-t :1" ], use_prefix = True )
-    binder.bind( "2", [ "select-window", "-t :2" ], use_prefix = True )
-    binder.bind( "3", [ "select-window", "-t :3" ], use_prefix = True )
-    binder.bind( "4", [ "select-window", "-t :4" ], use_prefix = True )
-    binder.bind( "5", [ "select-window", "-t :5" ], use_prefix = True )
-    binder.bind( "6", [ "select-window", "-t :6" ], use_prefix = True )
-    binder.bind( "7", [ "select-window", "-t :7" ], use_prefix = True )
-    binder.bind( "8", [ "select-window", "-t :8" ], use_prefix = True )
-    binder.bind( "9", [ "select-window", "-t :9" ], use_prefix = True )
+    binder.bind_range(
+        "0123456789", [ "select-window", "-t :{key}" ], use_prefix = True
+    )
     binder.bind( ":", [ "command-prompt" ], use_prefix = True )
     binder.bind( ";", [ "last-pane" ], use_prefix = True )
     binder.bind( "=", [ "choose-buffer" ], use_prefix = True )
@@ -299,14 +402,14 @@ def mode_default():
 
 def mode_empty():
 
-    return Binder( batch_mode )
+    return Binder( "empty", batch_mode )
 
 
 #----------------------------------------------------------------------------
 
 def mode_insert():
 
-    binder = Binder( batch_mode )
+    binder = Binder( "insert", batch_mode )
 
     pt = " -t"
     #if not pass_through:
@@ -316,9 +419,13 @@ def mode_insert():
     if not use_mode_colors:
         mc = ""
 
+    cc = ""
+    if cache_dir is not None:
+        cc = " -C " + cache_dir
+
     binder.bind( "C-\\", [
         "run-shell",
-        python + ' ' + modality + pt + mc + ' -p insert command'
+        python + ' ' + modality + pt + mc + cc + ' -p insert command'
     ] )
 
     if use_mode_colors:
@@ -357,13 +464,15 @@ class Binding( object ):
     #------------------------------------------------------------------------
 
     # Get the bind-key command for the command line.
-    def bind_key_cli( self ):
+    def bind_key_cli( self, table = None ):
 
         if self.disabled:
             self.command = self.get_disabled_command()
 
         cmd_parts = []
-        if not self.use_prefix:
+        if table is not None:
+            cmd_parts.extend( [ "-T", table ] )
+        elif not self.use_prefix:
             cmd_parts.append( "-n" )
 
         # Escape special shell characters in the key:
@@ -384,7 +493,7 @@ class Binding( object ):
     #------------------------------------------------------------------------
 
     # Get the bind-key command for writing to a file.
-    def bind_key_file( self ):
+    def bind_key_file( self, table = None ):
 
         escape_chars = r"\$"
 
@@ -392,7 +501,9 @@ class Binding( object ):
             self.command = self.get_disabled_command()
 
         cmd_parts = []
-        if not self.use_prefix:
+        if table is not None:
+            cmd_parts.extend( [ "-T", table ] )
+        elif not self.use_prefix:
             cmd_parts.append( "-n" )
 
         quote_char = '"'
@@ -428,6 +539,14 @@ class Binding( object ):
         )
 
 
+    #------------------------------------------------------------------------
+
+    # Generate the bindings of this definition, i.e., just this one.
+    def expand( self ):
+
+        yield self
+
+
     #------------------------------------------------------------------------
 
     # Get the command to use if this key is disabled.
@@ -451,6 +570,63 @@ class Binding( object ):
     #------------------------------------------------------------------------
 
 
+#----------------------------------------------------------------------------
+
+# A family of bindings sharing one command, such as "select-pane -t N" on
+# each digit key.  In the key format and in each command part, "{key}" is
+# replaced by the item from keys and "{index}" by its position, counting
+# from start.  Nothing else is substituted, so tmux formats such as
+# "#{window_index}" may be used as is.  Bindings are only expanded when
+# the key table they belong to is emitted.
+class BindingTemplate( object ):
+
+    #------------------------------------------------------------------------
+
+    # Constructor.
+    def __init__(
+        self,
+        keys,
+        command,
+        use_prefix = False,
+        key_format = "{key}",
+        start = 1
+    ):
+
+        self.command = command
+        self.key_format = key_format
+        self.keys = keys
+        self.start = start
+        self.use_prefix = use_prefix
+
+
+    #------------------------------------------------------------------------
+
+    # Generate the bindings.
+    def expand( self ):
+
+        for index, key in enumerate( self.keys, self.start ):
+
+            index = str( index )
+            key = str( key )
+
+            yield Binding(
+                self._fill( self.key_format, index, key ),
+                [ self._fill( part, index, key ) for part in self.command ],
+                self.use_prefix
+            )
+
+
+    #------------------------------------------------------------------------
+
+    # Substitute the template fields in a string.
+    def _fill( self, text, index, key ):
+
+        return text.replace( "{index}", index ).replace( "{key}", key )
+
+
+    #------------------------------------------------------------------------
+
+
 #----------------------------------------------------------------------------
 
 class Binder( object ):
@@ -475,17 +651,17 @@ class Binder( object ):
         "KPEnter",
     ]
 
-
-    #------------------------------------------------------------------------
-
     # Constructor.
-    def __init__( self, use_tempfile = True ):
+    def __init__( self, name, use_tempfile = True ):
 
-        self.bound = {}
+        self.definitions = []
         self.extra_commands = []
+        self.name = name
+        self.prior = None
         self.script = None
         self.unbound = {}
         self.use_tempfile = use_tempfile
+        self._tables = {}
         
 
     #------------------------------------------------------------------------
@@ -499,13 +675,43 @@ class Binder( object ):
     # Add a binding.
     def bind( self, key, command = None, use_prefix = False, disabled = False ):
 
-        self.bound[ key ] = Binding( key, command, use_prefix, disabled )
+        self.definitions.append( Binding( key, command, use_prefix, disabled ) )
+        self._tables = {}
+
+
+    #------------------------------------------------------------------------
+
+    # Add a family of bindings from a template (see BindingTemplate).  The
+    # keys may be any sequence that can be iterated more than once, such as
+    # a string, list or xrange.
+    def bind_range(
+        self,
+        keys,
+        command,
+        use_prefix = False,
+        key_format = "{key}",
+        start = 1
+    ):
+
+        self.definitions.append( BindingTemplate(
+            keys, command, use_prefix, key_format, start
+        ) )
+        self._tables = {}
+
+
+    #------------------------------------------------------------------------
+
+    # Cache the key table and switch scripts in the given files.
+    def cache( self, table_file, switch_file ):
+
+        self._write_atomic( table_file, self._emit_table )
+        self._write_atomic( switch_file, self._emit_switch )
 
 
     #------------------------------------------------------------------------
 
     # Emit a key (un)binding.
-    def _emit_binding( self, binding, unbind = False ):
+    def _emit_binding( self, binding, unbind = False, table = None ):
 
         global tmux
 
@@ -516,31 +722,16 @@ class Binder( object ):
         if self.use_tempfile:
             self.script.write (
                 command_name + " " +
-                " ".join( binding.bind_key_file() ) +
+                " ".join( binding.bind_key_file( table ) ) +
                 "\n"
             )
         else:
-            command = binding.bind_key_cli()
+            command = binding.bind_key_cli( table )
             command.insert( 0, command_name )
             command.insert( 0, tmux )
             subprocess.call( command )
 
 
-    #------------------------------------------------------------------------
-
-    # Emit all key (un)bindings.
-    def _emit_bindings( self ):
-
-        # Emit bindings:
-        for key, binding in self.bound.iteritems():
-            self._emit_binding( binding )
-
-        # Emit un-bindings if not masked by a binding:
-        for key, binding in self.unbound.iteritems():
-            if key not in self.bound:
-                self._emit_binding( binding, unbind = True )
-
-
     #------------------------------------------------------------------------
 
     # Emit a command.
@@ -557,6 +748,76 @@ class Binder( object ):
             subprocess.call( command )
 
 
+    #------------------------------------------------------------------------
+
+    # Emit the commands for switching to this mode, once its key table (if
+    # it has one) is installed.  Their number does not depend on the size
+    # of the key table.
+    def _emit_switch( self ):
+
+        table = table_name( self.name )
+
+        # Bindings in the prefix and root tables are shared by all modes,
+        # so the prior mode's bindings there are replaced:
+        prefixed = self.table( use_prefix = True )
+        rooted = {}
+        if table == "root":
+            rooted = self.table( use_prefix = False )
+
+        for bound in ( prefixed, rooted ):
+            for key, binding in bound.iteritems():
+                self._emit_binding( binding )
+
+        if self.prior is not None:
+            prior_tables = [ ( prefixed, self.prior.table( use_prefix = True ) ) ]
+            if table_name( self.prior.name ) == "root":
+                prior_tables.append(
+                    ( rooted, self.prior.table( use_prefix = False ) )
+                )
+
+            for bound, prior in prior_tables:
+                for key, binding in prior.iteritems():
+                    if key not in bound:
+                        unbinding = binding.copy()
+                        unbinding.unbind()
+                        self._emit_binding( unbinding, unbind = True )
+
+        for key, binding in self.unbound.iteritems():
+            if binding.use_prefix:
+                bound = prefixed
+            else:
+                bound = rooted
+            if key not in bound:
+                self._emit_binding( binding, unbind = True )
+
+        self._emit_command( [ "set-option", "-g", "key-table", table ] )
+
+        # Emit extra commands:
+        for command in self.extra_commands:
+            self._emit_command( command )
+
+
+    #------------------------------------------------------------------------
+
+    # Emit the key table holding the non-prefixed bindings of this mode,
+    # replacing the previously installed one, if any.
+    def _emit_table( self, installed = None ):
+
+        table = table_name( self.name )
+        if table == "root":
+            return
+
+        if installed:
+            self._emit_command( [ "unbind-key", "-a", "-T", installed ] )
+
+        for key, binding in self.table( use_prefix = False ).iteritems():
+            self._emit_binding( binding, table = table )
+
+        self._emit_command(
+            [ "set-option", "-g", "@modality-" + self.name, table ]
+        )
+
+
     #------------------------------------------------------------------------
 
     # Disable all keys.
@@ -571,22 +832,27 @@ class Binder( object ):
 
     #------------------------------------------------------------------------
 
-    # Execute the bindings and unbindings.
+    # Execute the bindings and unbindings.  The key table is only emitted
+    # if it is not installed yet.
     def execute( self ):
 
         global tmux
 
+        table = table_name( self.name )
+
+        installed = table
+        if table != "root":
+            installed = installed_table( self.name )
+
         # Create the script file:
         if self.use_tempfile:
             self.script = tempfile.NamedTemporaryFile( delete = False )
             #print( "Script file: " + self.script.name )
 
-        # Emit key bindings:
-        self._emit_bindings()
+        if installed != table:
+            self._emit_table( installed )
 
-        # Emit extra commands:
-        for command in self.extra_commands:
-            self._emit_command( command )
+        self._emit_switch()
 
         # Execute the script file, then delete it:
         if self.use_tempfile:
@@ -607,17 +873,29 @@ class Binder( object ):
 
     #------------------------------------------------------------------------
 
-    # Mask the bindings of another binder.
+    # Mask the prefixed bindings of another binder.
     def set_prior_mode( self, binder ):
 
-        for key, binding in binder.bound.iteritems():
+        self.prior = binder
+
+
+    #------------------------------------------------------------------------
+
+    # Get the prefixed or non-prefixed bindings by key, expanding any
+    # templates among them.  Later definitions take precedence.
+    def table( self, use_prefix ):
 
-            #if binding.use_prefix:
-                #continue
+        if use_prefix not in self._tables:
 
-            unbinding = binding.copy()
-            unbinding.unbind()
-            self.unbound[ key ] = unbinding
+            table = {}
+            for definition in self.definitions:
+                if definition.use_prefix == use_prefix:
+                    for binding in definition.expand():
+                        table[ binding.key ] = binding
+
+            self._tables[ use_prefix ] = table
+
+        return self._tables[ use_prefix ]
 
 
     #------------------------------------------------------------------------
@@ -630,20 +908,34 @@ class Binder( object ):
 
     #------------------------------------------------------------------------
 
-    # Write binding commands out to a file.
-    def write( self, filename ):
+    # Write binding commands out to a file.  Unless table is False, the
+    # file installs the key table as well as switching to it.
+    def write( self, filename, table = True ):
 
         # Create the script file:
         self.script = open( filename, "w" )
 
-        # Emit key bindings:
-        self._emit_bindings()
+        if table:
+            self._emit_table()
 
-        # Emit extra commands:
-        for command in self.extra_commands:
-            self._emit_command( command )
+        self._emit_switch()
 
         self.script.close()
+        self.script = None
+
+
+    #------------------------------------------------------------------------
+
+    # Write to a file under a temporary name, then rename it, so that a
+    # concurrent mode switch never sources a partially written script.
+    def _write_atomic( self, filename, emit ):
+
+        fd, temp_name = tempfile.mkstemp( dir = os.path.dirname( filename ) )
+        self.script = os.fdopen( fd, "w" )
+        emit()
+        self.script.close()
+        self.script = None
+        os.rename( temp_name, filename )
 
 
     #------------------------------------------------------------------------
@@ -651,7 +943,8 @@ class Binder( object ):
 
 #----------------------------------------------------------------------------
 
-main( args )
+if __name__ == "__main__":
+    main( parser.parse_args() )
 
 
 #----------------------------------------------------------------------------
@@ -0,0 +1,352 @@
+#----------------------------------------------------------------------------
+# Tests for modality.py
+#
+# Run with: python2 -m unittest discover tests
+#----------------------------------------------------------------------------
+
+import imp
+import os
+import pty
+import select
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+
+#----------------------------------------------------------------------------
+
+modality = imp.load_source(
+    "modality",
+    os.path.join( os.path.dirname( __file__ ), os.pardir, "modality.py" )
+)
+
+# Number of bindings added to command mode for the stress tests, on top
+# of the ~130 it has already:
+stress_bindings = 1870
+
+
+#----------------------------------------------------------------------------
+
+def setUpModule():
+
+    modality.batch_mode = True
+    modality.cache_dir = None
+    modality.pass_through = False
+    modality.use_mode_colors = True
+    modality.stamp = modality.settings_stamp()
+
+
+#----------------------------------------------------------------------------
+
+# Build command mode, optionally with a large family of extra bindings.
+def command_mode( extra = 0 ):
+
+    binder = modality.mode_command()
+
+    # Any UTF-8 character is a valid tmux key:
+    keys = [ unichr( 0x4e00 + i ).encode( "utf-8" ) for i in xrange( extra ) ]
+    binder.bind_range( keys, [ "select-window", "-t", ":{index}" ] )
+
+    return binder
+
+
+#----------------------------------------------------------------------------
+
+def count_lines( filename ):
+
+    with open( filename ) as script:
+        return len( script.readlines() )
+
+
+#----------------------------------------------------------------------------
+
+class BindingTemplateTest( unittest.TestCase ):
+
+    #------------------------------------------------------------------------
+
+    def test_expand( self ):
+
+        template = modality.BindingTemplate(
+            "120", [ "select-window", "-t", ":{index}" ],
+            key_format = "M-{key}"
+        )
+        bindings = [ ( b.key, b.command ) for b in template.expand() ]
+
+        self.assertEqual( bindings, [
+            ( "M-1", [ "select-window", "-t", ":1" ] ),
+            ( "M-2", [ "select-window", "-t", ":2" ] ),
+            ( "M-0", [ "select-window", "-t", ":3" ] ),
+        ] )
+
+
+    #------------------------------------------------------------------------
+
+    def test_tmux_formats( self ):
+
+        template = modality.BindingTemplate(
+            "a", [ "display-message", "#{window_index} {key}" ]
+        )
+        binding = next( template.expand() )
+
+        self.assertEqual(
+            binding.command, [ "display-message", "#{window_index} a" ]
+        )
+
+
+    #------------------------------------------------------------------------
+
+    def test_precedence( self ):
+
+        binder = modality.Binder( "test" )
+        binder.bind( "1", [ "first" ] )
+        binder.bind_range( "12", [ "second" ] )
+        binder.bind( "2", [ "third" ] )
+
+        table = binder.table( use_prefix = False )
+        self.assertEqual( table[ "1" ].command, [ "second" ] )
+        self.assertEqual( table[ "2" ].command, [ "third" ] )
+
+
+    #------------------------------------------------------------------------
+
+
+#----------------------------------------------------------------------------
+
+class StressTest( unittest.TestCase ):
+
+    #------------------------------------------------------------------------
+
+    def setUp( self ):
+
+        self.dir = tempfile.mkdtemp()
+
+
+    #------------------------------------------------------------------------
+
+    def tearDown( self ):
+
+        shutil.rmtree( self.dir )
+
+
+    #------------------------------------------------------------------------
+
+    def test_table_size( self ):
+
+        small = os.path.join( self.dir, "small.conf" )
+        large = os.path.join( self.dir, "large.conf" )
+        command_mode().write( small )
+        command_mode( stress_bindings ).write( large )
+
+        self.assertEqual(
+            count_lines( large ), count_lines( small ) + stress_bindings
+        )
+
+
+    #------------------------------------------------------------------------
+
+    def test_switch_size( self ):
+
+        small = os.path.join( self.dir, "small.conf" )
+        large = os.path.join( self.dir, "large.conf" )
+        command_mode().write( small, table = False )
+        command_mode( stress_bindings ).write( large, table = False )
+
+        self.assertEqual( count_lines( large ), count_lines( small ) )
+
+
+    #------------------------------------------------------------------------
+
+    def test_switch_expansion( self ):
+
+        filename = os.path.join( self.dir, "switch.conf" )
+        binder = command_mode( stress_bindings )
+        binder.set_prior_mode( modality.mode_insert() )
+
+        # Count expansions of non-prefixed templates:
+        expanded = []
+        expand = modality.BindingTemplate.expand
+
+        def counting_expand( template ):
+            if not template.use_prefix:
+                expanded.append( template )
+            return expand( template )
+
+        modality.BindingTemplate.expand = counting_expand
+        try:
+            binder.write( filename, table = False )
+        finally:
+            modality.BindingTemplate.expand = expand
+
+        self.assertEqual( expanded, [] )
+
+
+    #------------------------------------------------------------------------
+
+
+#----------------------------------------------------------------------------
+
+@unittest.skipUnless( os.path.exists( modality.tmux ), "tmux not found" )
+class TmuxTest( unittest.TestCase ):
+
+    #------------------------------------------------------------------------
+
+    # Start a tmux server of our own.
+    def setUp( self ):
+
+        self.dir = tempfile.mkdtemp()
+        self.environ = dict( os.environ )
+        os.environ[ "TMUX_TMPDIR" ] = self.dir
+        os.environ.pop( "TMUX", None )
+
+        self.tmux( "new-session", "-d" )
+        self.client = None
+
+
+    #------------------------------------------------------------------------
+
+    def tearDown( self ):
+
+        self.tmux( "kill-server" )
+        if self.client is not None:
+            os.close( self.terminal )
+            os.waitpid( self.client, 0 )
+
+        os.environ.clear()
+        os.environ.update( self.environ )
+        shutil.rmtree( self.dir )
+
+
+    #------------------------------------------------------------------------
+
+    # Switch to the given mode, returning the number of bindings emitted.
+    def switch( self, binder, prior ):
+
+        emitted = []
+        emit_binding = binder._emit_binding
+
+        def counting_emit_binding( binding, *args, **kwargs ):
+            emitted.append( binding.key )
+            emit_binding( binding, *args, **kwargs )
+
+        binder._emit_binding = counting_emit_binding
+        binder.set_prior_mode( prior )
+        binder.execute()
+
+        return len( emitted )
+
+
+    #------------------------------------------------------------------------
+
+    # Attach a client in a pseudo-terminal, so that keys can be pressed.
+    def attach( self ):
+
+        self.client, self.terminal = pty.fork()
+        if self.client == 0:
+            os.environ[ "TERM" ] = "xterm"
+            os.execv( modality.tmux, [ modality.tmux, "attach-session" ] )
+
+        self.drain()
+
+
+    #------------------------------------------------------------------------
+
+    # Discard the client's output for a while.
+    def drain( self, seconds = 0.5 ):
+
+        end = time.time() + seconds
+        while time.time() < end:
+            readable = select.select( [ self.terminal ], [], [], 0.05 )[ 0 ]
+            if readable:
+                try:
+                    os.read( self.terminal, 65536 )
+                except OSError:
+                    return
+
+
+    #------------------------------------------------------------------------
+
+    # Press a key in the attached client.
+    def press( self, sequence ):
+
+        os.write( self.terminal, sequence )
+        self.drain()
+
+
+    #------------------------------------------------------------------------
+
+    def tmux( self, *args ):
+
+        with open( os.devnull, "w" ) as devnull:
+            return subprocess.check_output(
+                ( modality.tmux, ) + args, stderr = devnull
+            )
+
+
+    #------------------------------------------------------------------------
+
+    def test_switch( self ):
+
+        table = modality.table_name( "command" )
+
+        # The first switch installs the key table:
+        self.switch( command_mode( stress_bindings ), modality.mode_insert() )
+        self.assertEqual(
+            self.tmux( "show-options", "-g", "-v", "key-table" ).strip(),
+            table
+        )
+        installed = len( self.tmux( "list-keys", "-T", table ).splitlines() )
+        self.assertGreater( installed, stress_bindings )
+
+        # Later switches only change the key table, and unbind the insert
+        # mode keys from the root table:
+        self.switch( modality.mode_insert(), command_mode( stress_bindings ) )
+        emitted = self.switch(
+            command_mode( stress_bindings ), modality.mode_insert()
+        )
+        self.assertEqual(
+            emitted, len( modality.mode_insert().table( use_prefix = False ) )
+        )
+        self.assertEqual(
+            self.tmux( "show-options", "-g", "-v", "key-table" ).strip(),
+            table
+        )
+        self.assertEqual(
+            len( self.tmux( "list-keys", "-T", table ).splitlines() ),
+            installed
+        )
+
+
+    #------------------------------------------------------------------------
+
+    def test_root_table( self ):
+
+        # A binding of the user's, alongside tmux's default ones:
+        self.tmux( "bind-key", "-n", "F5", "set-option", "-g", "@fired", "yes" )
+        self.attach()
+
+        self.switch( command_mode(), modality.mode_insert() )
+        self.switch( modality.mode_insert(), command_mode() )
+        self.assertEqual(
+            self.tmux( "show-options", "-g", "-v", "key-table" ).strip(),
+            "root"
+        )
+        self.assertIn(
+            "MouseDown1Pane", self.tmux( "list-keys", "-T", "root" )
+        )
+
+        self.press( "\x1b[15~" )
+        self.assertEqual(
+            self.tmux( "show-options", "-g", "-q", "-v", "@fired" ).strip(),
+            "yes"
+        )
+
+
+    #------------------------------------------------------------------------
+
+
+#----------------------------------------------------------------------------
+
+
+# vi: set filetype=python shiftwidth=4 tabstop=4 expandtab: